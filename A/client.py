@@ -1,15 +1,23 @@
 import sys
-import random
-import threading
+import os
+import asyncio
+import logging
 import struct
 import socket
-import select
 
 HELLO = 1
 DATA = 2
 ALIVE = 3
 GOODBYE = 4
 
+# Message header: magic, version, command, sequence number, session id, logical clock
+HDR = struct.Struct("!HBBIIQ")
+PREFIX = struct.Struct("!HB")
+BODY = struct.Struct("!BIIQ")
+MAX_DATAGRAM = 65507  # Largest UDP payload over IPv4
+
+logger = logging.getLogger(__name__)
+
 def get_command_line_args():
     if len(sys.argv) != 3:
         sys.exit("Expected command line args: server_host port_number")
@@ -20,164 +28,207 @@ def get_command_line_args():
         sys.exit(f"Error: {e}.\nPlease enter a valid integer.")
     return server_host, port_num
 
-class Client:
+class Client(asyncio.DatagramProtocol):
 
     def __init__(self, server_host, server_port):
         self.magic_number = int('0xC461', 16)  # Magic number as integer
         self.version = 1              
         self.sequence_number = 0
-        self.session_id = random.randint(0, 4294967295)  # Ensure within range for 4-byte unsigned int
+        self.session_id = int.from_bytes(os.urandom(4), 'big')  # Random 4-byte unsigned int
         self.timeout = 8  # seconds
         self.logical_clock = 0  # 64-bit unsigned logical clock
-        self.clock_lock = threading.Lock()  # Lock for clock synchronization
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP socket
+        self.transport = None  # UDP transport, set once the endpoint is created
+        self.sendto = None
+        self.sendbuf = bytearray(MAX_DATAGRAM)
+        self.sendview = memoryview(self.sendbuf)
+        PREFIX.pack_into(self.sendbuf, 0, self.magic_number, self.version)
         self.server_host = server_host
         self.server_port = server_port
         self.idle_timer = None
-        self.shutdown_event = threading.Event()
-        self.client_socket.settimeout(self.timeout)
+        self.hello_received = False
+        self.exit_code = 0
+        self.stdin_fd = sys.stdin.fileno()
+        self.interactive = sys.stdin.isatty()
+        self.input_buffer = b''
+        self.reading_input = False
+        self.shutdown_event = asyncio.Event()
 
     def update_logical_clock(self, new_value=None):
-        with self.clock_lock:
-            if new_value is not None:
-                if new_value > self.logical_clock:
-                    self.logical_clock = new_value + 1
-                else:
-                    self.logical_clock += 1
-            else:
-                self.logical_clock += 1
-            return self.logical_clock
+        # Only touched from the event loop, no lock needed
+        if new_value is not None:
+            value = max(new_value, self.logical_clock) + 1
+        else:
+            value = self.logical_clock + 1
+        self.logical_clock = value
+        return value
 
     def issue_timeout(self):
         print(f"Idle time of {self.timeout} seconds expired.")
         self.send_message(GOODBYE) # send message will update the logical clock value 
-        self.shutdown_event.set()
+        self.shutdown()
 
     def set_timer(self):
-        self.idle_timer = threading.Timer(self.timeout, self.issue_timeout)
-        self.idle_timer.start()
-    
+        # Restarted on every received message, fires after self.timeout seconds of silence
+        self.cancel_timer()
+        self.idle_timer = asyncio.get_running_loop().call_later(self.timeout, self.issue_timeout)
+
     def cancel_timer(self):
         if self.idle_timer is not None:
             self.idle_timer.cancel()
             self.idle_timer = None
 
+    def shutdown(self):
+        self.cancel_timer()
+        self.stop_input()
+        self.shutdown_event.set()
+
     def send_message(self, command, data=None):
-        # Lock the clock before reading and updating
         logical_clock_value = self.update_logical_clock()
         
-        header = struct.pack("!HBBIIQ", self.magic_number, self.version, command, self.sequence_number, self.session_id, logical_clock_value)
+        BODY.pack_into(self.sendbuf, PREFIX.size, command, self.sequence_number, self.session_id, logical_clock_value)
+        size = HDR.size
         if data is not None:
-            message = header + data
-        else:
-            message = header
-        self.client_socket.sendto(message, (self.server_host, self.server_port))
+            size += len(data)
+            self.sendview[HDR.size:size] = data
+        self.sendto(self.sendview[:size])
         self.sequence_number += 1
-        print(f"Sent: Command={command}, Data={data}, Logical Clock={logical_clock_value}")
+        logger.debug("Sent: Command=%d, Data=%r, Logical Clock=%d", command, data, logical_clock_value)
         if command == GOODBYE:
             print("Sending GOODBYE from client. Closing client.")
-            self.shutdown_event.set()
+            self.shutdown()
 
     def decode_message(self, message):
         try:
-            header = struct.unpack("!HBBIIQ", message[:20])  # Added 8 bytes for 64-bit logical clock
+            header = HDR.unpack_from(message)
             magic_number, version, command, sequence_number, session_id, logical_clock_value = header
-            payload = message[20:]  # The rest of the message is payload if any
+            payload = memoryview(message)[20:]  # The rest of the message is payload if any, viewed without copying
 
-            print(f"Received Message: Magic Number={hex(magic_number)}, Version={version}, Command={command}, Sequence Number={sequence_number}, Session ID={session_id}, Logical Clock={logical_clock_value}, Payload={payload.decode() if payload else 'None'}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received Message: Magic Number=%#x, Version=%d, Command=%d, Sequence Number=%d, Session ID=%d, Logical Clock=%d, Payload=%s",
+                             magic_number, version, command, sequence_number, session_id, logical_clock_value, str(payload, 'utf-8') if payload else 'None')
 
-            return command, logical_clock_value  # Return command to check in receive_message
+            return command, logical_clock_value  # Return command to check in datagram_received
 
         except struct.error as e:
             print(f"Struct error: {e}")
-            self.shutdown_event.set()
+            self.shutdown()
 
-    def receive_message(self):
-        while not self.shutdown_event.is_set():
-            try:
-                response, _ = self.client_socket.recvfrom(1024)  # Buffer size is 1024 bytes
-                self.cancel_timer()
-                command, received_clock_value = self.decode_message(response)
-                self.update_logical_clock(received_clock_value)
+    def connection_made(self, transport):
+        self.transport = transport
+        self.sendto = transport.sendto
 
-                if command == GOODBYE:  # Check if the response command is GOODBYE
-                    print("Received GOODBYE from server. Closing client.")
-                    self.shutdown_event.set()
+    def datagram_received(self, data, addr):
+        if self.shutdown_event.is_set():
+            return
+        self.set_timer()
+        decoded = self.decode_message(data)
+        if decoded is None:
+            return
+        command, received_clock_value = decoded
 
-            except socket.timeout:
-                print("Receive timeout occurred.")
-                self.issue_timeout()
+        if not self.hello_received:
+            self.update_logical_clock()
+            print("HELLO = ", HELLO)
+            if command != HELLO:  # Check if the response command is not hello
+                print("Did not receive hello from server. Closing client.")
+                self.exit_code = 1
+                self.shutdown()
+            else:
+                print("Received hello from server.")
+                self.hello_received = True
+                self.start_input()
+            return
 
-    def handle_input(self):
-        if sys.stdin.isatty():
+        self.update_logical_clock(received_clock_value)
+        if command == GOODBYE:  # Check if the response command is GOODBYE
+            print("Received GOODBYE from server. Closing client.")
+            self.shutdown()
+
+    def error_received(self, exc):
+        print(f"Error received: {exc}")
+
+    def start_input(self):
+        if self.interactive:
             print("Enter data to send to the server (type 'q' to quit):")
-            while not self.shutdown_event.is_set():
-                # Use select to wait for input on stdin or until the shutdown event is set
-                rlist, _, _ = select.select([sys.stdin], [], [], 1)  # Timeout of 1 second to allow periodic checks
-                if rlist:  # There's input available in stdin
-                    line = sys.stdin.readline().strip()
-                    self.update_logical_clock()
-
-                    if line == 'q' or line == 'eof':
-                        self.update_logical_clock()
-
-                        print("Exiting...")
-                        self.shutdown_event.set()  # Signal to shut down the client
-                    elif line:
-                        print()
-                        print(f"Sending data: {line}")
-                        self.send_message(DATA, line.encode())
-                        self.set_timer()  # Set the idle timer to trigger timeout
-                elif self.shutdown_event.is_set():
-                    break  # Exit loop if shutdown event is triggered
-        else:
-            # If stdin is redirected (e.g., from a file), handle it here
-            for line in sys.stdin:
-                line = line.strip()
-                if line:
-                    print()
-                    print(f"Sending data: {line}")
-                    self.send_message(DATA, line.encode())
-                    self.set_timer()
-            
+        try:
+            # The callback only fires when stdin has bytes, no periodic polling
+            asyncio.get_running_loop().add_reader(self.stdin_fd, self.handle_input)
+            self.reading_input = True
+        except PermissionError:
+            # Regular files cannot be watched by epoll, but they never block either
+            asyncio.get_running_loop().call_soon(self.read_input_file)
+
+    def stop_input(self):
+        if self.reading_input:
+            asyncio.get_running_loop().remove_reader(self.stdin_fd)
+            self.reading_input = False
+
+    def handle_input(self):
+        chunk = os.read(self.stdin_fd, 4096)
+        if not chunk:
+            self.stop_input()
+            self.end_of_input()
+            return
+        # Keep any partial line until the rest of it arrives
+        *lines, self.input_buffer = (self.input_buffer + chunk).split(b'\n')
+        for line in lines:
+            self.handle_line(line.decode().strip())
+            if self.shutdown_event.is_set():
+                return
+
+    def read_input_file(self):
+        for line in sys.stdin:
+            self.handle_line(line.strip())
+            if self.shutdown_event.is_set():
+                return
+        self.end_of_input()
+
+    def handle_line(self, line):
+        if self.interactive:
+            self.update_logical_clock()
+            if line == 'q' or line == 'eof':
+                self.update_logical_clock()
+
+                print("Exiting...")
+                self.shutdown()  # Signal to shut down the client
+                return
+        if line:
+            print()
+            print(f"Sending data: {line}")
+            self.send_message(DATA, line.encode())
+
+    def end_of_input(self):
+        if self.input_buffer:
+            line, self.input_buffer = self.input_buffer, b''
+            self.handle_line(line.decode().strip())
 
         # Ensure GOODBYE is sent before shutdown
         if not self.shutdown_event.is_set():
             self.send_message(GOODBYE)
 
-    def run(self):
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(
+            lambda: self,
+            remote_addr=(self.server_host, self.server_port),
+            family=socket.AF_INET)
+
         print("Hello from client...to server")
         self.send_message(HELLO)
         self.update_logical_clock()
-
         self.set_timer()
-        try:
-            response, _ = self.client_socket.recvfrom(1024)  # Buffer size is 1024 bytes
-            self.cancel_timer()
-            command, _ = self.decode_message(response)
-            self.update_logical_clock()
-            print("HELLO = ", HELLO)
-            if command != HELLO:  # Check if the response command is not hello
-                print("Did not receive hello from server. Closing client.")
-                sys.exit(1)
-            else:
-                print("Received hello from server.")
-        except socket.timeout:
-            print("Receive timeout occurred.")
-            self.issue_timeout()
-        
-        # Start the threads for handling input and receiving messages
-        input_thread = threading.Thread(target=self.handle_input, daemon=True)
-        receive_thread = threading.Thread(target=self.receive_message, daemon=True)
-        input_thread.start()
-        receive_thread.start()
 
-        # Wait for shutdown event
-        self.shutdown_event.wait()
-
-        self.client_socket.close()
+        try:
+            # Wait for shutdown event
+            await self.shutdown_event.wait()
+        finally:
+            self.shutdown()
+            self.transport.close()
+        return self.exit_code
 
 if __name__ == '__main__':
+    level = logging.DEBUG if os.environ.get("UAP_DEBUG") else logging.INFO
+    logging.basicConfig(stream=sys.stdout, level=level, format="%(message)s")
     server_host, port_num = get_command_line_args()
     client_session = Client(server_host, port_num)
-    client_session.run()
\ No newline at end of file
+    sys.exit(asyncio.run(client_session.run()))
\ No newline at end of file
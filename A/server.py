@@ -1,91 +1,105 @@
 import sys
+import os
 import asyncio
+import heapq
+import logging
 import struct
-import threading
 
 HELLO = 1
 DATA = 2
 ALIVE = 3
 GOODBYE = 4
 
+# Message header: magic, version, command, sequence number, session id, logical clock
+HDR = struct.Struct("!HBBIIQ")
+PREFIX = struct.Struct("!HB")
+BODY = struct.Struct("!BIIQ")
+# Only the fields needed to route a datagram: command, sequence number, session id
+DISPATCH = struct.Struct("!3xBII")
+MAX_DATAGRAM = 65507  # Largest UDP payload over IPv4
+
+logger = logging.getLogger(__name__)
+
 class ServerSession:
     def __init__(self, server, client_address, session_id, initial_sequence_number):
         self.server = server  # Reference to the main server
+        self.sendto = server.transport.sendto
         self.client_address = client_address
         self.session_id = session_id
         self.expected_sequence_number = initial_sequence_number + 1
         self.state = "WAIT_FOR_HELLO"
-        self.idle_timer = None
+        self.deadline = None  # Idle deadline on the event loop clock, tracked by the server
+        self.queued_deadline = None  # Deadline of this session's entry in the server heap, if any
         self.timeout = 20  # Timeout for inactivity
 
-    async def set_timer(self):
-        self.cancel_timer()  # Cancel any existing timer first
-        self.idle_timer = asyncio.create_task(self.session_timeout())
+    def set_timer(self):
+        # Moving the deadline is enough while an entry is queued, the server re-queues it when it fires early
+        self.deadline = asyncio.get_running_loop().time() + self.timeout
+        if self.queued_deadline is None:
+            self.server.schedule_timeout(self)
 
     def cancel_timer(self):
-        if self.idle_timer:
-            self.idle_timer.cancel()
-            self.idle_timer = None
+        self.deadline = None
 
-    async def session_timeout(self):
-        await asyncio.sleep(self.timeout)
+    def session_timeout(self):
         print(f"Session timeout for {self.client_address}, sending GOODBYE.")
-        await self.send_message(GOODBYE)
+        self.send_message(GOODBYE)
         self.state = "DONE"
         self.terminate()
 
-    async def send_message(self, command, sequence_number=0, data=None):
-        # Update logical clock and use lock for synchronization
+    def send_message(self, command, sequence_number=0, data=None):
         logical_clock_value = self.server.update_logical_clock()
 
-        header = struct.pack("!HBBIIQ", 0xC461, 1, command, sequence_number, self.session_id, logical_clock_value)
+        BODY.pack_into(self.server.sendbuf, PREFIX.size, command, sequence_number, self.session_id, logical_clock_value)
+        size = HDR.size
         if data:
-            message = header + data
-        else:
-            message = header
-        self.server.transport.sendto(message, self.client_address)
+            size += len(data)
+            self.server.sendview[HDR.size:size] = data
+        self.sendto(self.server.sendview[:size], self.client_address)
 
-    async def handle_hello(self, sequence_number):
+    def handle_hello(self, sequence_number):
         if self.state == "WAIT_FOR_HELLO":
             print(f"Received HELLO from {self.client_address}, session {self.session_id}")
-            await self.send_message(HELLO, sequence_number)
+            self.send_message(HELLO, sequence_number)
             self.state = "RECEIVE"
-            await self.set_timer()
+            self.set_timer()
         else:
             print(f"Protocol error: HELLO received in state {self.state}")
-            await self.send_message(GOODBYE)
+            self.send_message(GOODBYE)
             self.state = "DONE"
             self.terminate()
 
-    async def handle_data(self, sequence_number, data, received_logical_clock):
+    def handle_data(self, sequence_number, data, received_logical_clock):
         if self.state == "RECEIVE":
             # Update server's logical clock based on the received value
             self.server.update_logical_clock(received_logical_clock)
 
             if sequence_number == self.expected_sequence_number:
-                print(f"Received DATA from {self.client_address}: {data.decode()}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received DATA from %s: %s", self.client_address, str(data, 'utf-8'))
                 self.expected_sequence_number += 1
-                await self.send_message(ALIVE, sequence_number)
-                await self.set_timer()  # Reset the timer
+                self.send_message(ALIVE, sequence_number)
+                self.set_timer()  # Reset the timer
             elif sequence_number > self.expected_sequence_number:
                 for i in range(self.expected_sequence_number, sequence_number):
                     print(f"Lost packet {i} from {self.client_address}")
                 self.expected_sequence_number = sequence_number + 1
 
-                print(f"Received DATA from {self.client_address}: {data.decode()}")
-                await self.send_message(ALIVE, sequence_number)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received DATA from %s: %s", self.client_address, str(data, 'utf-8'))
+                self.send_message(ALIVE, sequence_number)
             elif sequence_number == self.expected_sequence_number - 1:
                 print(f"Duplicate packet {sequence_number} received from {self.client_address}. Discarding.")
             else:
                 print(f"Protocol error: Sequence number out of order from {self.client_address}.")
-                await self.send_message(GOODBYE)
+                self.send_message(GOODBYE)
                 self.state = "DONE"
                 self.terminate()
 
-    async def handle_goodbye(self):
+    def handle_goodbye(self):
         if self.state == "RECEIVE":
             print(f"Received GOODBYE from {self.client_address}, closing session.")
-            await self.send_message(GOODBYE)
+            self.send_message(GOODBYE)
             self.state = "DONE"
             self.terminate()
 
@@ -95,74 +109,109 @@ class ServerSession:
         # Remove this session from the server's session list
         del self.server.sessions[self.session_id]
 
-    async def handle_message(self, message):
-        header = message[:20]
-        magic_number, version, command, sequence_number, session_id, received_logical_clock = struct.unpack("!HBBIIQ", header)
+    def handle_message(self, message):
+        magic_number, version, command, sequence_number, session_id, received_logical_clock = HDR.unpack_from(message)
         if magic_number != 0xC461 or version != 1:
             print(f"Protocol error: Invalid message from {self.client_address}")
-            await self.send_message(GOODBYE)
+            self.send_message(GOODBYE)
             self.state = "DONE"
             self.terminate()
             return
         
         if session_id != self.session_id:
             print(f"Protocol error: Invalid session id from {self.client_address}")
-            await self.send_message(GOODBYE)
+            self.send_message(GOODBYE)
             self.state = "DONE"
             self.terminate()
             return
 
         if command == HELLO:
-            await self.handle_hello(sequence_number)
+            self.handle_hello(sequence_number)
         elif command == DATA:
-            data = message[20:]
-            await self.handle_data(sequence_number, data, received_logical_clock)
+            data = memoryview(message)[20:]  # Payload view, no copy
+            self.handle_data(sequence_number, data, received_logical_clock)
         elif command == GOODBYE:
-            await self.handle_goodbye()
+            self.handle_goodbye()
         else:
             print(f"Protocol error: Unknown command from {self.client_address}")
-            await self.send_message(GOODBYE)
+            self.send_message(GOODBYE)
             self.state = "DONE"
             self.terminate()
 
 class UDPServerProtocol(asyncio.DatagramProtocol):
     def __init__(self):
-        self.sessions = {}  # Stores active sessions by session_id
-        self.client_addresses = {}  # Stores the address of clients by session_id
-        self.logical_clock = 0  # 64-bit unsigned logical clock
-        self.clock_lock = threading.Lock()  # Lock for synchronization
+        self.sendbuf = bytearray(MAX_DATAGRAM)
+        self.sendview = memoryview(self.sendbuf)
+        PREFIX.pack_into(self.sendbuf, 0, 0xC461, 1)  # send_message only packs BODY behind these bytes
+        self.sessions = {}  # Stores (session, client address) of active sessions by session_id
+        self.logical_clock = 0  # 64-bit unsigned logical clock, only touched from the event loop
+        self.deadlines = []  # Heap of (deadline, session_id) for idle timeouts
+        self.timeout_handle = None  # Single loop timer, armed for the earliest deadline
 
     def update_logical_clock(self, received_clock=None):
-        with self.clock_lock:
-            if received_clock is not None and received_clock > self.logical_clock:
-                self.logical_clock = received_clock + 1
+        if received_clock is not None and received_clock > self.logical_clock:
+            self.logical_clock = received_clock + 1
+        else:
+            self.logical_clock += 1
+        return self.logical_clock
+
+    def schedule_timeout(self, session):
+        session.queued_deadline = session.deadline
+        heapq.heappush(self.deadlines, (session.deadline, session.session_id))
+        if self.timeout_handle is not None:
+            if self.timeout_handle.when() <= session.deadline:
+                return
+            self.timeout_handle.cancel()
+        self.timeout_handle = asyncio.get_running_loop().call_at(session.deadline, self.expire_sessions)
+
+    def expire_sessions(self):
+        self.timeout_handle = None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, session_id = heapq.heappop(self.deadlines)
+            entry = self.sessions.get(session_id)
+            # Entries left behind by a closed session no longer match
+            if entry is None or entry[0].queued_deadline != deadline:
+                continue
+            session = entry[0]
+            if session.deadline is None:
+                session.queued_deadline = None
+            elif session.deadline > deadline:
+                # Reset since this entry was queued, keep its single entry at the new deadline
+                session.queued_deadline = session.deadline
+                heapq.heappush(self.deadlines, (session.deadline, session_id))
             else:
-                self.logical_clock += 1
-            return self.logical_clock
+                session.queued_deadline = None
+                session.session_timeout()
+        if self.deadlines:
+            self.timeout_handle = loop.call_at(self.deadlines[0][0], self.expire_sessions)
 
     def connection_made(self, transport):
         self.transport = transport
         print("Server is up and listening for clients...")
 
     def datagram_received(self, data, addr):
+        # Reject short datagrams before routing so they can never create a session
+        if len(data) < HDR.size:
+            print(f"Malformed message from {addr}, ignoring.")
+            return
         try:
-            session_id = struct.unpack("!I", data[8:12])[0]  # Extract session_id from message
-            sequence_number = struct.unpack("!I", data[4:8])[0]
-            command = struct.unpack("!B", data[3:4])[0]
+            command, sequence_number, session_id = DISPATCH.unpack_from(data)
 
-            if session_id in self.sessions:
+            entry = self.sessions.get(session_id)
+            if entry is not None:
                 # Ensure the client address matches the one for this session
-                if addr == self.client_addresses[session_id]:
-                    asyncio.create_task(self.sessions[session_id].handle_message(data))
+                if addr == entry[1]:
+                    entry[0].handle_message(data)
                 else:
                     print(f"Ignoring client {addr} with duplicate session ID {session_id}.")
             else:
                 # Check if the HELLO message starts a new session
                 if command == HELLO:
                     new_session = ServerSession(self, addr, session_id, sequence_number)
-                    self.sessions[session_id] = new_session
-                    self.client_addresses[session_id] = addr  # Store client address for this session
-                    asyncio.create_task(new_session.handle_message(data))
+                    self.sessions[session_id] = (new_session, addr)
+                    new_session.handle_message(data)
                 else:
                     print(f"Invalid initial message from {addr}, expected HELLO.")
         except struct.error as e:
@@ -191,4 +240,6 @@ async def main():
         transport.close()
 
 if __name__ == '__main__':
+    level = logging.DEBUG if os.environ.get("UAP_DEBUG") else logging.INFO
+    logging.basicConfig(stream=sys.stdout, level=level, format="%(message)s")
     asyncio.run(main())
\ No newline at end of file
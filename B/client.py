@@ -1,7 +1,8 @@
 import sys
 import asyncio
+import logging
 import struct
-import random
+import os
 import socket
 
 HELLO = 1
@@ -9,13 +10,25 @@ DATA = 2
 ALIVE = 3
 GOODBYE = 4
 
+# Message header: magic, version, command, sequence number, session id, logical clock
+HDR = struct.Struct("!HBBIIQ")
+PREFIX = struct.Struct("!HB")
+BODY = struct.Struct("!BIIQ")
+MAX_DATAGRAM = 65507  # Largest UDP payload over IPv4
+
+logger = logging.getLogger(__name__)
+
 class AsyncUDPClient:
     def __init__(self, server_host, server_port):
         self.server_host = server_host
         self.server_port = server_port
-        self.session_id = random.randint(0, 4294967295)
+        self.session_id = int.from_bytes(os.urandom(4), 'big')
         self.sequence_number = 0
         self.transport = None
+        self.sendto = None
+        self.sendbuf = bytearray(MAX_DATAGRAM)
+        self.sendview = memoryview(self.sendbuf)
+        PREFIX.pack_into(self.sendbuf, 0, 0xC461, 1)
         self.logical_clock = 0 # initialized to zero
 
     def update_logical_clock(self, new_value=None):
@@ -30,13 +43,13 @@ class AsyncUDPClient:
         
     def connection_made(self, transport):
         self.transport = transport
+        self.sendto = transport.sendto
         print(f"Connected to {self.server_host}:{self.server_port}")
         # Send the initial HELLO message
-        asyncio.create_task(self.send_message(HELLO))
+        self.send_message(HELLO)
 
     def datagram_received(self, data, addr):
-        print()
-        asyncio.create_task(self.handle_response(data))
+        self.handle_response(data)
 
     def error_received(self, exc):
         print(f"Error received: {exc}")
@@ -46,23 +59,25 @@ class AsyncUDPClient:
         asyncio.get_event_loop().stop()
         # pass
 
-    async def send_message(self, command, data=None):
+    def send_message(self, command, data=None):
         """Send a message to the server."""
 
-        header = struct.pack("!HBBIIQ", 0xC461, 1, command, self.sequence_number, self.session_id, self.logical_clock)
-        message = header + (data if data else b'')
-        self.transport.sendto(message, (self.server_host, self.server_port))
-        print(f"Sent message with command {command} and sequence number {self.sequence_number}")
+        BODY.pack_into(self.sendbuf, PREFIX.size, command, self.sequence_number, self.session_id, self.logical_clock)
+        size = HDR.size
+        if data:
+            size += len(data)
+            self.sendview[HDR.size:size] = data
+        self.sendto(self.sendview[:size])  # The transport is connected to the server
+        logger.debug("Sent message with command %d and sequence number %d", command, self.sequence_number)
         self.sequence_number += 1
         self.update_logical_clock()
 
-    async def handle_response(self, message):
+    def handle_response(self, message):
         """Handle the response received from the server."""
-        header = message[:20]
-        magic_number, version, command, sequence_number, session_id, received_clock_value = struct.unpack("!HBBIIQ", header)
+        magic_number, version, command, sequence_number, session_id, received_clock_value = HDR.unpack_from(message)
         self.update_logical_clock(received_clock_value)
 
-        payload = message[20:] if len(message) > 20 else b''
+        payload = memoryview(message)[20:]  # Payload view, no copy
 
         if magic_number != 0xC461 or version != 1:
             print("Protocol error: Invalid magic number or version.")
@@ -73,19 +88,18 @@ class AsyncUDPClient:
             return
 
         if command == ALIVE:
-            print(f"Received ALIVE from server, clock: {received_clock_value}. Sequence number: {sequence_number}")
+            logger.debug("Received ALIVE from server, clock: %d. Sequence number: %d", received_clock_value, sequence_number)
         elif command == GOODBYE:
             print("Received GOODBYE from server, clock: {received_clock_value}. Closing connection.")
             self.transport.close()
         else:
-            print(f"Received message with command {command} and sequence number {sequence_number}, clock: {received_clock_value}")
-            if payload:
-                print(f"Payload: {payload.decode()}")
+            logger.debug("Received message with command %d and sequence number %d, clock: %d", command, sequence_number, received_clock_value)
+            if payload and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Payload: %s", str(payload, 'utf-8'))
 
-    async def send_data(self, data):
+    def send_data(self, data):
         """Send data messages."""
-        await self.send_message(DATA, data.encode())
-        await asyncio.sleep(0.1)
+        self.send_message(DATA, data.encode())
 
     async def handle_user_input(self):
         """Handle user input to send data to the server."""
@@ -98,10 +112,10 @@ class AsyncUDPClient:
             if data == 'q' or data == 'eof':
                 break
             if data:
-                await self.send_data(data)
+                self.send_data(data)
 
         # Send the GOODBYE message to terminate the session
-        await self.send_message(GOODBYE)
+        self.send_message(GOODBYE)
 
     async def start(self):
         """Start the client and handle communication."""
@@ -135,4 +149,6 @@ async def main():
     await client.start()
 
 if __name__ == '__main__':
+    level = logging.DEBUG if os.environ.get("UAP_DEBUG") else logging.INFO
+    logging.basicConfig(stream=sys.stdout, level=level, format="%(message)s")
     asyncio.run(main())
\ No newline at end of file
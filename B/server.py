@@ -1,7 +1,9 @@
+import asyncio
+import logging
+import os
+import signal
 import socket
-import threading
 import struct
-import random
 import sys
 import time
 
@@ -10,6 +12,20 @@ DATA = 2
 ALIVE = 3
 GOODBYE = 4
 
+# Message header: magic, version, command, sequence number, session id, logical clock
+HDR = struct.Struct("!HBBIIQ")
+PREFIX = struct.Struct("!HB")
+BODY = struct.Struct("!BIIQ")
+MAX_DATAGRAM = 65507  # Largest UDP payload over IPv4
+
+RECV_BATCH = 32  # Datagrams drained per read wakeup
+RECV_BUFFER_SIZE = 1 << 20  # Kernel receive buffer, sized for bursts between wakeups
+
+SESSION_TIMEOUT = 20  # Seconds of inactivity before a session is timed out
+JANITOR_INTERVAL = 1  # Seconds between sweeps for idle sessions
+
+logger = logging.getLogger(__name__)
+
 class ServerSession:
     def __init__(self, client_address, server_socket, session_id, server):
         self.client_address = client_address
@@ -17,21 +33,9 @@ class ServerSession:
         self.session_id = session_id
         self.expected_sequence = 0
         self.active = True
-        self.timer = None
+        self.last_seen = time.monotonic()
         self.server = server
-
-    def start(self):
-        self.set_timer()
-
-    def set_timer(self, timeout=20):
-        if self.timer:
-            self.timer.cancel()
-        self.timer = threading.Timer(timeout, self.issue_timeout)
-        self.timer.start()
-
-    def cancel_timer(self):
-        if self.timer:
-            self.timer.cancel()
+        self.sendto = server_socket.sendto
 
     def issue_timeout(self):
         print(f"Session {hex(self.session_id)} timeout. Sending GOODBYE.")
@@ -43,9 +47,8 @@ class ServerSession:
         self.send_message(HELLO, seq_num)
 
     def handle_data(self, seq_num, payload, clock_value):
-        print()
-        print("Clock value", clock_value)
-        
+        logger.debug("Session %#x: Clock value %d", self.session_id, clock_value)
+
         if seq_num > self.expected_sequence:
             print(f"Session {hex(self.session_id)}: Lost packets! Expected {self.expected_sequence} but received {seq_num}.")
             self.expected_sequence = seq_num + 1
@@ -53,7 +56,8 @@ class ServerSession:
             print(f"Session {hex(self.session_id)}: Duplicate packet received, discarding.")
             return
 
-        print(f"Session {hex(self.session_id)}: Received DATA: {payload.decode()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Session %#x: Received DATA: %s", self.session_id, str(payload, 'utf-8'))
         self.expected_sequence += 1
         self.send_message(ALIVE, seq_num)
 
@@ -67,111 +71,136 @@ class ServerSession:
     
     def send_message(self, command, seq_num, data=None):
         current_clock_value = self.server.update_logical_clock()
-        header = struct.pack("!HBBIIQ", 0xC461, 1, command, seq_num, self.session_id, current_clock_value)
-        message = header + (data if data else b'')
-        self.server_socket.sendto(message, self.client_address)
+        BODY.pack_into(self.server.sendbuf, PREFIX.size, command, seq_num, self.session_id, current_clock_value)
+        size = HDR.size
+        if data:
+            size += len(data)
+            self.server.sendview[HDR.size:size] = data
+        try:
+            self.sendto(self.server.sendview[:size], self.client_address)
+        except (BlockingIOError, InterruptedError):
+            # The socket is non-blocking, drop the message rather than abort the receive batch
+            print(f"Session {hex(self.session_id)}: Send buffer full, dropping message.")
 
-    def process_message(self, message):
-        self.cancel_timer()  # Reset timer on message receipt
-        self.set_timer()
+    def process_message(self, header, message):
+        # The header was already decoded by the server, don't unpack it twice
+        self.last_seen = time.monotonic()  # The janitor times out sessions from this
 
-        try:
-            header = struct.unpack("!HBBIIQ", message[:20])
-            magic, version, command, seq_num, session_id, received_logical_clock = header
-            payload = message[20:] if len(message) > 20 else None
+        magic, version, command, seq_num, session_id, received_logical_clock = header
+        payload = memoryview(message)[20:] if len(message) > 20 else None  # Payload view, no copy
 
-            if magic != 0xC461 or version != 1:
-                print(f"Invalid packet received from {self.client_address}, discarding.")
-                return
+        if magic != 0xC461 or version != 1:
+            print(f"Invalid packet received from {self.client_address}, discarding.")
+            return
 
-            if command == HELLO:
-                self.handle_hello(seq_num)
-            elif command == DATA:
-                self.handle_data(seq_num, payload, received_logical_clock)
-            elif command == GOODBYE:
-                self.handle_goodbye()
-        except struct.error as e:
-            print(f"Error decoding message: {e}")
+        if command == HELLO:
+            self.handle_hello(seq_num)
+        elif command == DATA:
+            self.handle_data(seq_num, payload, received_logical_clock)
+        elif command == GOODBYE:
+            self.handle_goodbye()
     
     def close(self):
-        self.cancel_timer()
         self.send_goodbye()
         print(f"Session {hex(self.session_id)} closed.")
 
 
 class UDPServer:
-    def __init__(self, port):
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.server_socket.bind(('', port))
-        print(f"Server listening on port {port}...")
+    def __init__(self, server_socket):
+        self.server_socket = server_socket
+        self.server_socket.setblocking(False)
+        print(f"Server listening on port {server_socket.getsockname()[1]}... (pid {os.getpid()})")
+        self.sendbuf = bytearray(MAX_DATAGRAM)
+        self.sendview = memoryview(self.sendbuf)
+        PREFIX.pack_into(self.sendbuf, 0, 0xC461, 1)
+        self.recvbuf = bytearray(MAX_DATAGRAM)  # Every datagram is received into this buffer
+        self.recvview = memoryview(self.recvbuf)
         self.sessions = {}
-        self.lock = threading.Lock()
-        self.logical_clock = 0
-        self.clock_lock = threading.Lock()  # Lock for clock synchronization
+        self.janitor_handle = None  # One periodic sweep instead of a timer per session
+        self.logical_clock = 0  # Single-threaded event loop, no lock needed
 
     def update_logical_clock(self, received_clock=None):
-        with self.clock_lock:
-            if received_clock is not None and received_clock > self.logical_clock:
-                self.logical_clock = received_clock + 1
-            else:
-                self.logical_clock += 1
-            return self.logical_clock
-            
+        if received_clock is not None and received_clock > self.logical_clock:
+            self.logical_clock = received_clock + 1
+        else:
+            self.logical_clock += 1
+        return self.logical_clock
+
+    def expire_sessions(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_seen > SESSION_TIMEOUT:
+                session.issue_timeout()
+                del self.sessions[session_id]
+        self.janitor_handle = asyncio.get_running_loop().call_later(JANITOR_INTERVAL, self.expire_sessions)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.server_socket.fileno(), self.read_ready)
+        self.janitor_handle = loop.call_later(JANITOR_INTERVAL, self.expire_sessions)
+
+    def close(self):
+        self.janitor_handle.cancel()
+        asyncio.get_running_loop().remove_reader(self.server_socket.fileno())
+        self.server_socket.close()
+
+    def read_ready(self):
+        # Drain up to RECV_BATCH queued datagrams per wakeup instead of one per select
+        for _ in range(RECV_BATCH):
+            try:
+                size, client_address = self.server_socket.recvfrom_into(self.recvbuf)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionResetError:
+                print("Connection reset by a client. Ignoring and continuing.")
+                continue  # Keep the server running after the error
+            # The view is only valid until the next receive, handlers must not keep it
+            self.handle_client(self.recvview[:size], client_address)
+
     def handle_client(self, message, client_address):
         try:
             # Unpack the message header
-            header = struct.unpack("!HBBIIQ", message[:20])
+            header = HDR.unpack_from(message)
             magic, version, command, seq_num, session_id, received_clock_value = header
         except struct.error:
             print("Malformed message received. Ignoring.")
             return
         self.update_logical_clock(received_clock_value)
         
-        with self.lock:
-            session = self.sessions.get(session_id)
-
-            # Check if the session already exists and is from a different client
-            if session and session.client_address != client_address:
-                print(f"Session {hex(session_id)} already in use by another client {session.client_address}. Rejecting {client_address}.")
-                self.update_logical_clock()
-                self.send_rejection(client_address, session_id)
+        session = self.sessions.get(session_id)
+
+        # Check if the session already exists and is from a different client
+        if session and session.client_address != client_address:
+            print(f"Session {hex(session_id)} already in use by another client {session.client_address}. Rejecting {client_address}.")
+            self.update_logical_clock()
+            self.send_rejection(client_address, session_id)
+            return
+
+        # If no session exists or it's the same client, proceed
+        if not session:
+            if command == HELLO:
+                print(f"New session {hex(session_id)} from {client_address}.")
+                session = ServerSession(client_address, self.server_socket, session_id, self)
+                self.sessions[session_id] = session
+            else:
+                print(f"Session {hex(session_id)} not found for client {client_address}. Ignoring.")
                 return
+        
+        # Process the message with the session
+        session.process_message(header, message)
 
-            # If no session exists or it's the same client, proceed
-            if not session:
-                if command == HELLO:
-                    print(f"New session {hex(session_id)} from {client_address}.")
-                    session = ServerSession(client_address, self.server_socket, session_id, self)
-                    self.sessions[session_id] = session
-                    session.start()
-                else:
-                    print(f"Session {hex(session_id)} not found for client {client_address}. Ignoring.")
-                    return
-            
-            # Process the message with the session
-            session.process_message(message)
-
-            # If the session is no longer active, remove it
-            if not session.active:
-                del self.sessions[session_id]
+        # If the session is no longer active, remove it
+        if not session.active:
+            del self.sessions[session_id]
 
     def send_rejection(self, client_address, session_id):
         # Construct and send a rejection message to the client
         # For example, you could send a special command or error code
         rejection_message = f"Session ID {hex(session_id)} is already in use. Connection rejected.".encode()
-        self.server_socket.sendto(rejection_message, client_address)
-
-    def run(self):
-        while True:
-            try:
-                message, client_address = self.server_socket.recvfrom(1024)
-                threading.Thread(target=self.handle_client, args=(message, client_address)).start()
-            except ConnectionResetError:
-                print(f"Connection reset by {client_address}. Ignoring and continuing.")
-                continue  # Keep the server running after the error
-            except KeyboardInterrupt:
-                print("Server shutting down.")
-                break
+        try:
+            self.server_socket.sendto(rejection_message, client_address)
+        except (BlockingIOError, InterruptedError):
+            print(f"Send buffer full, dropping rejection for {client_address}.")
 
 
 
@@ -183,7 +212,88 @@ def get_server_args():
     return port
 
 
+def create_server_sockets(port, count):
+    if count > 1:
+        # Probe without SO_REUSEPORT first, so a server already on the port still fails with EADDRINUSE
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.bind(('', port))
+        finally:
+            probe.close()
+
+    sockets = []
+    for _ in range(count):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+        if count > 1:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind(('', port))
+        sockets.append(server_socket)
+    return sockets
+
+
+async def main(server_socket):
+    server = UDPServer(server_socket)
+    server.start()
+
+    try:
+        await asyncio.get_running_loop().create_future()  # Serve until interrupted
+    finally:
+        server.close()
+
+
+def serve(server_socket):
+    if sys.platform == "win32":
+        # The default proactor loop has no add_reader, the selector loop does
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    try:
+        asyncio.run(main(server_socket))
+    except KeyboardInterrupt:
+        print("Server shutting down.")
+
+
+def stop(signum, frame):
+    sys.exit(0)
+
+
+def run_workers(port):
+    # One event loop per core. The kernel hashes each client address to one worker,
+    # so a session always lands on the process that holds its state.
+    if hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT"):
+        worker_count = os.cpu_count() or 1
+    else:
+        worker_count = 1
+
+    # Bind every socket before forking, so the reuseport group is complete before any client is served
+    sockets = create_server_sockets(port, worker_count)
+
+    workers = []
+    for server_socket in sockets[1:]:
+        pid = os.fork()
+        if pid == 0:
+            for other in sockets:
+                if other is not server_socket:
+                    other.close()
+            serve(server_socket)
+            os._exit(0)
+        workers.append(pid)
+    for server_socket in sockets[1:]:
+        server_socket.close()
+
+    signal.signal(signal.SIGTERM, stop)  # Unwind below so the workers are stopped too
+    try:
+        serve(sockets[0])
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
+
+
 if __name__ == '__main__':
+    level = logging.DEBUG if os.environ.get("UAP_DEBUG") else logging.INFO
+    logging.basicConfig(stream=sys.stdout, level=level, format="%(message)s")
     port = get_server_args()
-    server = UDPServer(port)
-    server.run()
\ No newline at end of file
+    run_workers(port)
\ No newline at end of file